@@ -1,13 +1,105 @@
 from pysnmp import hlapi
-from pysnmp.proto import rfc1902
+from pysnmp.proto import rfc1902, rfc1905
+from pysnmp.smi import view
 from sys import argv
-from pythonping import ping
-from datetime import datetime
+from datetime import timedelta
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+import argparse
+import concurrent.futures
 import csv
+import functools
 import ipaddress
+import itertools
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+
+# Maximum number of hosts pinged at the same time during a network scan.
+PING_WORKERS = 256
+# Maximum number of pings queued to the workers at a time, more are queued as pings complete.
+PING_QUEUE = PING_WORKERS * 2
+# Maximum number of devices queried over SNMP at the same time.
+SNMP_WORKERS = 64
+# Write buffer of the csv file. Rows are deliberately held here and written in large
+# blocks, so a typical scan reaches the file only when it is closed.
+CSV_BUFFER_SIZE = 1024 * 1024
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+ICMP_HEADER = struct.Struct('!BBHHH')
+IPV4_ADDRESS = struct.Struct('!I')
+ICMP_PAYLOAD = b'MKTools'
+# Receive buffer of the shared ICMP socket, room for replies of every concurrent ping.
+ICMP_RECEIVE_BUFFER = 1024 * 1024
+# Consecutive receive errors after which receiving ping replies is given up.
+ICMP_RECEIVE_ERROR_LIMIT = 100
+# Kernel receive timestamps of ICMP replies, Linux only. Python does not export the
+# option, value is from asm-generic/socket.h, where SCM_TIMESTAMPNS is the same.
+ICMP_KERNEL_TIMESTAMPS = sys.platform.startswith('linux')
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35)
+TIMESPEC = struct.Struct('@ll')
+# Ports tried by the tcp probe: raw printing, web interface and LPD.
+TCP_PROBE_PORTS = (9100, 80, 515)
+# SO_LINGER option closing connection with reset, struct linger is two u_short on Windows and two int elsewhere.
+TCP_ABORT_ON_CLOSE = struct.pack('HH' if sys.platform == 'win32' else 'ii', 1, 0)
+
+# Fields fetched from every device and their OIDs, in the order of the csv columns.
+_DEVICE_FIELDS = (
+    ('model', '.1.3.6.1.2.1.1.1.0'),
+    ('serial', '.1.3.6.1.2.1.43.5.1.1.17.1'),
+    ('location', '.1.3.6.1.2.1.1.6.0'),
+    ('firmware', '.1.3.6.1.4.1.18334.1.1.1.5.5.1.1.3.1'),
+    ('hostname', '.1.3.6.1.4.1.18334.1.1.2.1.5.7.1.1.1.12.1'),
+    ('domain', '.1.3.6.1.4.1.18334.1.1.2.1.5.7.1.1.1.13.1'),
+    ('ip_address', '.1.3.6.1.4.1.18334.1.1.2.1.5.7.1.1.1.3.1'),
+    ('subnet', '.1.3.6.1.4.1.18334.1.1.2.1.5.7.1.1.1.4.1'),
+    ('gateway', '.1.3.6.1.4.1.18334.1.1.2.1.5.7.1.1.1.5.1'),
+    ('primary_dns', '.1.3.6.1.4.1.18334.1.1.2.1.5.7.1.2.1.3.1.1'),
+    ('secondary_dns', '.1.3.6.1.4.1.18334.1.1.2.1.5.7.1.2.1.3.1.2'),
+)
+_DEVICE_FIELD_NAMES = tuple(name for name, oid in _DEVICE_FIELDS)
+_DEVICE_OIDS = tuple(oid for name, oid in _DEVICE_FIELDS)
+
+# Csv columns. Device data is keyed by field name, so columns stay aligned
+# even if a value is missing.
+_CSV_FIELDNAMES = _DEVICE_FIELD_NAMES + ('response_address', 'latency_ms')
+
+_thread_data = threading.local()
+_context = None
+
+
+def _get_engine():
+    """
+    Return SNMP engine of the current thread. pysnmp engines are not thread safe,
+    so every thread creates its own engine on first request and reuses it.
+
+    @return:
+        engine          : SNMP engine from pysnmp hlapi (Obj)
+    """
+    engine = getattr(_thread_data, 'engine', None)
+    if (engine is None):
+        engine = _thread_data.engine = hlapi.SnmpEngine()
+    return engine
+
+
+def _get_context():
+    """
+    Return SNMP context data shared by all requests. Created on first request.
+
+    @return:
+        context         : SNMP context data from pysnmp hlapi (Obj)
+    """
+    global _context
+    if (_context is None):
+        _context = hlapi.ContextData()
+    return _context
 
 
-def snmp_get(target, communityname, port=161, engine=hlapi.SnmpEngine(), context=hlapi.ContextData()):
+def snmp_get(target, communityname, port=161, engine=None, context=None):
     """
     Constuctor function for fetching OID data from device.
 
@@ -15,38 +107,30 @@ def snmp_get(target, communityname, port=161, engine=hlapi.SnmpEngine(), context
         target            - Required  : IP address of the device (Str)
         communityname     - Required  : SNMP community name (Str)
         port              - Optional  : UDP port for SNMP request (Int)
-        engine            - Optional  : SNMP engine for request, from pysnmp hlapi (Obj)
-        context           - Optional  : SNMP context data for request, from pysnmp hlapi (Obj)
+        engine            - Optional  : SNMP engine for request, from pysnmp hlapi. Defaults to engine of current thread (Obj)
+        context           - Optional  : SNMP context data for request, from pysnmp hlapi. Defaults to shared context (Obj)
 
     @return:
-        fetch()           : Dictionary of OID values from fetch function.
+        result            : Dictionary of device values keyed by field name, e.g. 'serial'.
     """
-    model = '.1.3.6.1.2.1.1.1.0'
-    serial = '.1.3.6.1.2.1.43.5.1.1.17.1'
-    location = '.1.3.6.1.2.1.1.6.0'
-    firmware = '.1.3.6.1.4.1.18334.1.1.1.5.5.1.1.3.1'
-    hostname = '.1.3.6.1.4.1.18334.1.1.2.1.5.7.1.1.1.12.1'
-    domain = '.1.3.6.1.4.1.18334.1.1.2.1.5.7.1.1.1.13.1'
-    ip_address = '.1.3.6.1.4.1.18334.1.1.2.1.5.7.1.1.1.3.1'
-    subnet = '.1.3.6.1.4.1.18334.1.1.2.1.5.7.1.1.1.4.1'
-    gateway = '.1.3.6.1.4.1.18334.1.1.2.1.5.7.1.1.1.5.1'
-    primary_dns = '.1.3.6.1.4.1.18334.1.1.2.1.5.7.1.2.1.3.1.1'
-    secondary_dns = '.1.3.6.1.4.1.18334.1.1.2.1.5.7.1.2.1.3.1.2'
-
-    oids = [model, serial, location, firmware, hostname, domain,
-            ip_address, subnet, gateway, primary_dns, secondary_dns]
-
+    if (engine is None):
+        engine = _get_engine()
+    if (context is None):
+        context = _get_context()
+    if (not _device_object_types_resolved):
+        _resolve_device_object_types(engine)
     handler = hlapi.getCmd(
         engine,
         communityname,
         hlapi.UdpTransportTarget((target, port)),
         context,
-        *construct_object_types(oids)
+        *_DEVICE_OBJECT_TYPES,
+        lookupMib=False
     )
-    return fetch(handler, 1)
+    return fetch(handler, _DEVICE_FIELD_NAMES)
 
 
-def snmp_set(target, value_pairs, communityname, port=161, engine=hlapi.SnmpEngine(), context=hlapi.ContextData()):
+def snmp_set(target, value_pairs, communityname, port=161, engine=None, context=None):
     """
     Constuctor function for setting OID data to device. Values set are returned back.
 
@@ -55,61 +139,138 @@ def snmp_set(target, value_pairs, communityname, port=161, engine=hlapi.SnmpEngi
         value_pairs       - Required  : Dictionary of OIDs and values, where OID is the key. (Dict)
         communityname     - Required  : SNMP community name (Str)
         port              - Optional  : UDP port for SNMP request (Int)
-        engine            - Optional  : SNMP engine for request, from pysnmp hlapi (Obj)
-        context           - Optional  : SNMP context data for request, from pysnmp hlapi (Obj)
+        engine            - Optional  : SNMP engine for request, from pysnmp hlapi. Defaults to engine of current thread (Obj)
+        context           - Optional  : SNMP context data for request, from pysnmp hlapi. Defaults to shared context (Obj)
 
     @return:
         fetch()           : Dictionary of OID values from fetch function.
     """
+    if (engine is None):
+        engine = _get_engine()
+    if (context is None):
+        context = _get_context()
     handler = hlapi.setCmd(
         engine,
         communityname,
         hlapi.UdpTransportTarget((target, port)),
         context,
-        *construct_value_pairs(value_pairs)
+        *construct_value_pairs(value_pairs),
+        lookupMib=False
     )
-    return fetch(handler, 1)
+    return fetch(handler)
 
 
 def to_csv(row, filename='Device_data.csv'):
     """
-    Writes list list of dictionary values to csv file.
+    Writes dictionary values to csv file one row at a time, so rows need not be kept in memory.
+    Rows are buffered and reach the file when the buffer fills or the file is closed.
+    File is not touched if there are no rows.
 
     @params:
-        row             - Required  : list of dictionary values (list dict).
+        row             - Required  : iterable of dictionary values, e.g. list or generator (iterable dict).
         filename        - Optional  : filename and realtive or absolute save path for device data csv. (Str)
+
+    @return:
+        count           : Number of rows written (Int)
     """
-    with open(filename, 'a', newline='') as csvfile:
-        writer = csv.writer(csvfile, delimiter=',')
-        writer.writerow(['model',
-                        'serial',
-                         'location',
-                         'firmware',
-                         'hostname',
-                         'domain',
-                         'ip_address',
-                         'subnet',
-                         'gateway',
-                         'primary_dns',
-                         'secondary_dns'])
-        for r in row:
-            writer.writerow(r.values())
+    rows = iter(row)
+    first = next(rows, None)
+    if (first is None):
+        return 0
+    count = 1
+    with open(filename, 'a', newline='', buffering=CSV_BUFFER_SIZE) as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=_CSV_FIELDNAMES, extrasaction='ignore', quoting=csv.QUOTE_MINIMAL)
+        writer.writeheader()
+        writer.writerow(first)
+        for data in rows:
+            writer.writerow(data)
+            count += 1
+    return count
 
 
+@functools.lru_cache(maxsize=256)
 def construct_object_types(list_of_oids):
-    object_types = []
-    for oid in list_of_oids:
-        object_types.append(hlapi.ObjectType(hlapi.ObjectIdentity(oid)))
-    return object_types
+    # Cached per tuple of OIDs: the object types are resolved against the MIB
+    # on first use and can then be reused for every device.
+    return tuple(hlapi.ObjectType(hlapi.ObjectIdentity(oid)) for oid in list_of_oids)
+
+
+_DEVICE_OBJECT_TYPES = construct_object_types(_DEVICE_OIDS)
+_device_object_types_resolved = False
+_resolve_lock = threading.Lock()
+
+
+def _resolve_device_object_types(engine):
+    """
+    Resolve device object types against the MIB once for all threads. Otherwise
+    every worker thread resolves the shared objects on its first request at the
+    same time, each loading the MIB on its own engine.
+
+    @params:
+        engine          - Required  : SNMP engine from pysnmp hlapi (Obj)
+    """
+    global _device_object_types_resolved
+    with _resolve_lock:
+        if (not _device_object_types_resolved):
+            # Stored where pysnmp hlapi looks for it, so the engine reuses the same view.
+            mib_view = engine.getUserContext('mibViewController')
+            if (mib_view is None):
+                mib_view = view.MibViewController(engine.getMibBuilder())
+                engine.setUserContext(mibViewController=mib_view)
+            for object_type in _DEVICE_OBJECT_TYPES:
+                object_type.resolveWithMib(mib_view)
+            _device_object_types_resolved = True
+
+
+_object_identities = {}
 
 
 def construct_value_pairs(list_of_pairs):
     pairs = []
     for key, value in list_of_pairs.items():
-        pairs.append(hlapi.ObjectType(hlapi.ObjectIdentity(key), value))
+        identity = _object_identities.get(key)
+        if (identity is None):
+            identity = _object_identities[key] = hlapi.ObjectIdentity(key)
+        pairs.append(hlapi.ObjectType(identity, value))
     return pairs
 
 
+def _no_value(value):
+    return ''
+
+
+# Printable ascii characters, as printed by pysnmp without hex conversion.
+_PRINTABLE_OCTETS = bytes(range(32, 127))
+
+
+def _octet_string_to_text(value):
+    # Same output as OctetString.prettyPrint, without its per-byte Python loop:
+    # printable text as is, anything else as hex.
+    octets = value.asOctets()
+    if (octets.translate(None, _PRINTABLE_OCTETS)):
+        return '0x' + octets.hex()
+    return octets.decode('ascii')
+
+
+# Conversion for known SNMP value types. Strings are kept as text, so values
+# like firmware version "1.10" are not turned into numbers.
+_CASTERS = {
+    rfc1902.OctetString: _octet_string_to_text,
+    rfc1902.Integer: int,
+    rfc1902.Integer32: int,
+    rfc1902.Unsigned32: int,
+    rfc1902.Counter32: int,
+    rfc1902.Counter64: int,
+    rfc1902.Gauge32: int,
+    rfc1902.TimeTicks: int,
+    rfc1902.IpAddress: rfc1902.IpAddress.prettyPrint,
+    rfc1902.ObjectName: str,
+    rfc1905.NoSuchObject: _no_value,
+    rfc1905.NoSuchInstance: _no_value,
+    rfc1905.EndOfMibView: _no_value,
+}
+
+
 def cast(value):
     """
     Convert OID value to correct data type.
@@ -120,6 +281,9 @@ def cast(value):
     @return:
         value               : Returns int, float, PrettyPrint, Str depending on OID value given.
     """
+    caster = _CASTERS.get(type(value))
+    if (caster is not None):
+        return caster(value)
     try:
         return int(value)
     except (ValueError, TypeError):
@@ -133,128 +297,405 @@ def cast(value):
     return value
 
 
-def fetch(handler, count):
+def fetch(handler, names=None):
     """
-    Get OIDs data from device.
+    Get OIDs data from device with a single request. Errors raised while
+    sending the request are passed to the caller.
 
     @params:
-        handler     - Required  : current iteration (Int)
-        count       - Required  : total iterations (Int)
+        handler     - Required  : request generator from pysnmp hlapi (Obj)
+        names       - Optional  : names for the values in request order, OIDs are used when not given (Str tuple)
 
     @return:
-        result                  : Dictionary of OID values.
+        result                  : Dictionary of OID values, empty if device did not respond or returned an error.
     """
-    result = {}
-    for i in range(count):
+    error_indication, error_status, error_index, var_binds = next(handler)
+    if not error_indication and not error_status:
+        if (names is not None):
+            # Response lists the values in the order they were requested.
+            return {name: cast(var_bind[1]) for name, var_bind in zip(names, var_binds)}
+        return {str(var_bind[0]): cast(var_bind[1]) for var_bind in var_binds}
+    if (error_status != 0):
+        print(error_status)
+    return {}
+
+
+_icmp_identifier = os.getpid() & 0xFFFF
+_icmp_sequence = itertools.count(1)
+_icmp_lock = threading.Lock()
+_icmp_socket = None
+# Pings waiting for reply: sequence number -> (IP address, Future, send wall clock time in ns, send performance counter in ns)
+_icmp_pending = {}
+# Error that stopped the thread receiving replies, pings can not succeed after it.
+_icmp_receive_error = None
+
+
+def _icmp_checksum(data):
+    if (len(data) % 2):
+        data += b'\0'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def _get_icmp_socket():
+    """
+    Return ICMP socket shared by all pings. First call opens the socket and
+    starts the thread receiving replies.
+
+    @return:
+        socket          : Raw ICMP socket, or unprivileged datagram ICMP socket when raw sockets are not allowed (Obj)
+    """
+    global _icmp_socket
+    if (_icmp_socket is None):
+        with _icmp_lock:
+            if (_icmp_socket is None):
+                try:
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+                except PermissionError:
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+                # The operating system may cap this, e.g. to net.core.rmem_max on Linux.
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, ICMP_RECEIVE_BUFFER)
+                timestamps = ICMP_KERNEL_TIMESTAMPS
+                if (timestamps):
+                    try:
+                        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+                    except OSError:
+                        # Option not supported, replies are timed when they are read.
+                        timestamps = False
+                # Receiving starts before anything is sent, Windows refuses to receive on unbound socket.
+                sock.bind(('', 0))
+                threading.Thread(target=_receive_icmp_replies, args=(sock, timestamps), daemon=True).start()
+                _icmp_socket = sock
+    return _icmp_socket
+
+
+def _receive_icmp_replies(sock, timestamps=False):
+    """
+    Receive echo replies from ICMP socket and complete the matching pending ping.
+    Runs in its own thread for the lifetime of the socket. If receiving fails
+    for good, the error is stored for ping_latency to raise.
+
+    @params:
+        sock        - Required  : ICMP socket (Obj)
+        timestamps  - Optional  : kernel receive timestamps are enabled on the socket (Bool)
+    """
+    global _icmp_receive_error
+    raw = sock.type == socket.SOCK_RAW
+    errors = 0
+    ancillary_size = socket.CMSG_SPACE(TIMESPEC.size) if timestamps else 0
+    while True:
         try:
-            error_indication, error_status, error_index, var_binds = next(
-                handler)
-            if not error_indication and not error_status:
-                items = {}
-                for var_bind in var_binds:
-                    items[str(var_bind[0])] = cast(var_bind[1])
-                result = items
+            if (timestamps):
+                packet, ancillary, _, address = sock.recvmsg(1024, ancillary_size)
             else:
-                if (error_status != 0):
-                    print(error_status)
-        except Exception as e:
-            print(e)
-    return result
+                packet, address = sock.recvfrom(1024)
+        except OSError as e:
+            errors += 1
+            # Closed socket fails at once, other errors may be temporary.
+            if (sock.fileno() == -1 or errors >= ICMP_RECEIVE_ERROR_LIMIT):
+                _icmp_receive_error = e
+                return
+            continue
+        errors = 0
+        received = time.perf_counter_ns()
+        kernel_received = None
+        if (timestamps):
+            # Time the packet arrived to the kernel, not affected by scheduling of this thread.
+            for level, message_type, data in ancillary:
+                if (level == socket.SOL_SOCKET and message_type == SO_TIMESTAMPNS):
+                    seconds, nanoseconds = TIMESPEC.unpack_from(data)
+                    kernel_received = seconds * 1000000000 + nanoseconds
+        # Raw sockets, and datagram sockets at least on macOS, receive the IP header too.
+        # ICMP types are below 64, so first byte with IP version 4 in its high nibble
+        # starts an IP header. Skip it, its length is in the low nibble.
+        if (len(packet) > 0 and packet[0] >> 4 == 4):
+            packet = packet[(packet[0] & 0x0F) * 4:]
+        if (len(packet) < ICMP_HEADER.size):
+            continue
+        reply_type, _, _, identifier, sequence = ICMP_HEADER.unpack_from(packet)
+        # Raw sockets receive every ICMP packet of the host, datagram sockets
+        # only replies to their own requests with identifier set by the kernel.
+        if (reply_type != ICMP_ECHO_REPLY or (raw and identifier != _icmp_identifier)):
+            continue
+        pending = _icmp_pending.get(sequence)
+        if (pending is not None and pending[0] == address[0] and _icmp_pending.pop(sequence, None) is not None):
+            latency = received - pending[3]
+            if (kernel_received is not None):
+                # Kernel time is wall clock time. It is used only when it falls inside the
+                # round trip measured with the performance counter, so a clock change can
+                # not give negative or too long latency.
+                kernel_latency = kernel_received - pending[2]
+                if (0 <= kernel_latency <= latency):
+                    latency = kernel_latency
+            pending[1].set_result(latency / 1000000)
+
+
+def ping_latency(host, timeout=0.5):
+    """
+    Ping given IP address and measure round trip time. One try and 500 ms timeout.
 
+    @params:
+        host      - Required  : IP address of the device (Str)
+        timeout   - Optional  : seconds to wait for the reply (Float)
 
-def ping_check(host):
+    @return:
+        latency               : Round trip time in milliseconds, None if no response received (Float)
+    """
+    sock = _get_icmp_socket()
+    if (_icmp_receive_error is not None):
+        raise RuntimeError(f'Receiving ping replies failed: {_icmp_receive_error}')
+    sequence = next(_icmp_sequence) & 0xFFFF
+    header = ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, 0, _icmp_identifier, sequence)
+    packet = ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, _icmp_checksum(header + ICMP_PAYLOAD), _icmp_identifier, sequence) + ICMP_PAYLOAD
+    reply = Future()
+    # Send time is taken before sending, the reply may arrive before sendto returns.
+    # Only receive time comes from the kernel: delay between this and the packet
+    # leaving, e.g. waiting for the GIL in sendto, is still counted in the latency.
+    _icmp_pending[sequence] = (host, reply, time.time_ns(), time.perf_counter_ns())
+    try:
+        sock.sendto(packet, (host, 0))
+        return reply.result(timeout)
+    except (OSError, concurrent.futures.TimeoutError):
+        # Sending fails for addresses like the broadcast address of the network.
+        return None
+    finally:
+        _icmp_pending.pop(sequence, None)
+
+
+def ping_check(host, timeout=0.5):
     """
     Ping given IP address. One try and 500 ms timeout.
 
     @params:
-        host   - Required  : IP address of the device (Str)
+        host      - Required  : IP address of the device (Str)
+        timeout   - Optional  : seconds to wait for the reply (Float)
+
+    @return:
+        boolean               : True if response received otherwise false.
+    """
+    return ping_latency(host, timeout) is not None
+
+
+def tcp_latency(host, ports=TCP_PROBE_PORTS, timeout=0.3):
+    """
+    Check if device is reachable by opening TCP connection to its service ports
+    and measure connection time. Unlike ping, does not require administrator privileges.
+
+    @params:
+        host      - Required  : IP address of the device (Str)
+        ports     - Optional  : TCP ports tried in order (Int tuple)
+        timeout   - Optional  : seconds to wait for each connection (Float)
 
     @return:
-        boolean            : True if response received otherwise false.
+        latency               : Connection time in milliseconds, None if device did not answer on any port (Float)
     """
-    response = ping(host, count=1, timeout=0.5)
+    for port in ports:
+        start = time.perf_counter_ns()
+        try:
+            sock = socket.create_connection((host, port), timeout)
+            latency = (time.perf_counter_ns() - start) / 1000000
+            # Nothing is sent, so the connection is reset instead of closed to
+            # leave no TIME_WAIT sockets behind from large scans.
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, TCP_ABORT_ON_CLOSE)
+            sock.close()
+            return latency
+        except ConnectionRefusedError:
+            # Refused connection is answered by the device itself, so it is reachable.
+            return (time.perf_counter_ns() - start) / 1000000
+        except OSError:
+            continue
+    return None
+
+
+def tcp_check(host, ports=TCP_PROBE_PORTS, timeout=0.3):
+    """
+    Check if device is reachable by opening TCP connection to its service ports.
+    Unlike ping, does not require administrator privileges.
 
-    for res in response._responses:
-        if (res.success):
-            return True
-    return False
+    @params:
+        host      - Required  : IP address of the device (Str)
+        ports     - Optional  : TCP ports tried in order (Int tuple)
+        timeout   - Optional  : seconds to wait for each connection (Float)
 
+    @return:
+        boolean               : True if device answered on any port otherwise false.
+    """
+    return tcp_latency(host, ports, timeout) is not None
 
-def ping_sweep(start, end, silent=False):
+
+# Reachability checks used by ping_sweep, selected with --probe. Both return
+# latency in milliseconds or None when device is not reachable.
+_PROBES = {
+    'icmp': ping_latency,
+    'tcp': tcp_latency,
+}
+
+
+def _run_bounded(executor, function, items, limit):
+    """
+    Run function for every item in executor, yielding item and its future as each completes.
+    At most limit items are queued at a time, so a long iterable is not submitted up front.
+
+    @params:
+        executor    - Required  : executor running the function (Obj)
+        function    - Required  : function called with one item (Function)
+        items       - Required  : items to run function for (Iterable)
+        limit       - Required  : maximum number of queued and running items (Int)
+
+    @return:
+        item, future            : item and its completed future (Tuple)
+    """
+    items = iter(items)
+    completed = queue.Queue()
+    pending = {}
+    for item in itertools.islice(items, limit):
+        future = executor.submit(function, item)
+        pending[future] = item
+        future.add_done_callback(completed.put)
+    while (len(pending) > 0):
+        future = completed.get()
+        yield pending.pop(future), future
+        for item in itertools.islice(items, 1):
+            future = executor.submit(function, item)
+            pending[future] = item
+            future.add_done_callback(completed.put)
+
+
+def ping_sweep(start_ip, end_ip, silent=False, probe='icmp', latencies=None):
     """
     Scan network range for devices with ping.
 
     @params:
-        start     - Required  : start ip address of the range (Str)
-        end       - Required  : end ip address of the range (Str)
+        start_ip  - Required  : first ip address of the range as integer, e.g. int(IPv4Address('192.168.1.1')) (Int)
+        end_ip    - Required  : last ip address of the range as integer (Int)
+        silent    - Optional  : do not print results (Bool)
+        probe     - Optional  : reachability check, 'icmp' for ping or 'tcp' for TCP connection (Str)
+        latencies - Optional  : dictionary filled with latency in milliseconds of each active host (Dict)
 
     @return:
         active_hosts          : List of ip adresses that responded to ping.
     """
-    start_time = datetime.now()
-    start_ip = int(ipaddress.IPv4Address(start))
-    end_ip = int(ipaddress.IPv4Address(end))
+    start_time = time.perf_counter()
+    # inet_ntoa formats addresses in C, several times faster than IPv4Address.
+    addresses = map(socket.inet_ntoa, map(IPV4_ADDRESS.pack, range(start_ip, end_ip + 1)))
     active_hosts = []
-    count = 0
 
     print('Scanning devices...')
-    for ip in progressBar(range(start_ip, end_ip + 1), prefix='|'):
-        address = str(ipaddress.IPv4Address(ip))
-        if (ping_check(address)):
-            count += 1
-            active_hosts.append(address)
+    # Pings are sent concurrently so the timeouts of unused addresses overlap.
+    executor = ThreadPoolExecutor(max_workers=PING_WORKERS)
+    try:
+        completed = _run_bounded(executor, _PROBES[probe], addresses, PING_QUEUE)
+        for address, future in progressBar(completed, prefix='|', total=end_ip - start_ip + 1):
+            latency = future.result()
+            if (latency is not None):
+                active_hosts.append(address)
+                if (latencies is not None):
+                    latencies[address] = round(latency, 3)
+    finally:
+        # Interrupted or failed sweep does not wait for the rest of the range.
+        executor.shutdown(wait=False, cancel_futures=True)
+    active_hosts.sort(key=ipaddress.IPv4Address)
+    count = len(active_hosts)
     if (not silent):
         print(f'{count} active hosts found: {active_hosts}')
 
-        end_time = datetime.now()
-        print(
-            f'Scanning devices from network copleted in: {end_time - start_time}\n')
+        elapsed = timedelta(seconds=time.perf_counter() - start_time)
+        print(f'Scanning devices from network copleted in: {elapsed}\n')
 
     return active_hosts
 
 
-def get_device_info(hosts, communityname, silent=False):
+def get_device_info(hosts, communityname):
     """
-    Get oid values from device.
+    Get oid values from device. Devices are yielded in the order they respond,
+    so results can be written out without keeping all of them in memory.
 
     @params:
         hosts           - Required  : list of IP adresses (Str list)
         communityname   - Required  : SNMP community name (Str)
 
     @return:
-        results         : List of dictionary containing oids and values (list dict)
+        data            : Dictionary of device values keyed by field name and response address, one per responding device (dict)
     """
-    results = []
+    print('Starting to collect information...')
+    yield from iter_device_info(hosts, communityname, progress=True)
 
-    def get_data():
-        data = snmp_get(host, communityname)
-        if (data is not None and len(data) > 0):
-            data['response_address'] = host
-            results.append(data)
 
-    if (not silent):
-        print('Starting to collect information...')
+def iter_device_info(hosts, communityname, progress=False):
+    """
+    Get oid values from devices, yielding each device as soon as it responds.
+    Queries not yet started are cancelled when the caller stops iterating. Queries
+    already running still finish before the program exits, for a silent device up
+    to pysnmp's default 1 s timeout for each of its 6 attempts.
 
-        for host in progressBar(hosts):
-            get_data()
+    @params:
+        hosts           - Required  : list of IP adresses (Str list)
+        communityname   - Required  : SNMP community name (Str)
+        progress        - Optional  : show progress bar (Bool)
 
-    else:
-        print('Looking for serialnumber...')
-        for host in hosts:
-            get_data()
+    @return:
+        data            : Dictionary of device values keyed by field name and response address, one per responding device (dict)
+    """
+    # Devices are queried concurrently so total time follows the slowest device.
+    executor = ThreadPoolExecutor(max_workers=SNMP_WORKERS)
+    try:
+        futures = {executor.submit(_get_host_data, host, communityname): host for host in hosts}
+        completed = as_completed(futures)
+        if (progress):
+            completed = progressBar(completed, prefix='|', total=len(futures))
+        for future in completed:
+            # Handled futures are dropped, so their results are not kept until the end.
+            host = futures.pop(future)
+            try:
+                data = future.result()
+            except Exception as e:
+                print(f'{host}: {e}')
+                continue
+            if (data is not None and len(data) > 0):
+                yield data
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _get_host_data(host, communityname):
+    """
+    Get oid values from single device. Runs in a worker thread of iter_device_info.
+
+    @params:
+        host            - Required  : IP address of the device (Str)
+        communityname   - Required  : SNMP community name (Str)
 
-    return results
+    @return:
+        data            : Dictionary of OID values and response address (dict)
+    """
+    data = snmp_get(host, communityname)
+    if (data is not None and len(data) > 0):
+        data['response_address'] = host
+    return data
 
 
 def get_device_by_serial(serialnumber, active_hosts, community):
-    dataset = get_device_info(active_hosts, community, True)
-    for data in dataset:
-        if (data['1.3.6.1.2.1.43.5.1.1.17.1'] == serialnumber):
+    """
+    Find device with given serialnumber. Stops querying devices at first match.
+
+    @params:
+        serialnumber    - Required  : serialnumber of the device (Str)
+        active_hosts    - Required  : list of IP adresses (Str list)
+        community       - Required  : SNMP community name (Str)
+
+    @return:
+        data            : Dictionary of device values keyed by field name, empty if not found (dict)
+    """
+    print('Looking for serialnumber...')
+    for data in iter_device_info(active_hosts, community):
+        if (data['serial'] == serialnumber):
             return data
-    return []
+    return {}
 
 
-def progressBar(iterable, prefix='', suffix='', decimals=1, length=100, fill='█', printEnd="\r"):
+def progressBar(iterable, prefix='', suffix='', decimals=1, length=100, fill='█', printEnd="\r", total=None):
     """
     Call in a loop to create terminal progress bar.
 
@@ -266,156 +707,154 @@ def progressBar(iterable, prefix='', suffix='', decimals=1, length=100, fill='
         length      - Optional  : character length of bar (Int)
         fill        - Optional  : bar fill character (Str)
         printEnd    - Optional  : end character (e.g. "\r", "\r\n") (Str)
+        total       - Optional  : total iterations, required when iterable has no length (Int)
     """
-    total = len(iterable)
+    if (total is None):
+        total = len(iterable)
     _prefix = prefix
-
-    # Progress Bar Printing Function
+    percentFormat = "{0:." + str(decimals) + "f}"
+    fullBar = fill * length
+    emptyBar = '-' * length
+    lastDrawn = None
+    # Draw about a hundred steps whatever the total is
+    step = max(1, total // 100)
+
+    # Progress Bar Printing Function, redraws only when the output changes
     def printProgressBar(iteration):
-        percent = ("{0:." + str(decimals) + "f}").format(100 *
-                                                         (iteration / float(total)))
+        nonlocal lastDrawn
+        if (iteration % step != 0 and iteration != total):
+            return
+        percent = percentFormat.format(100 * (iteration / float(total)))
         filledLength = int(length * iteration // total)
-        bar = fill * filledLength + '-' * (length - filledLength)
-        print(f'\r{_prefix} |{bar}| {percent}% {suffix}', end=printEnd)
+        if ((_prefix, filledLength, percent) == lastDrawn):
+            return
+        lastDrawn = (_prefix, filledLength, percent)
+        bar = fullBar[:filledLength] + emptyBar[filledLength:]
+        sys.stdout.write(f'\r{_prefix} |{bar}| {percent}% {suffix}{printEnd}')
+        sys.stdout.flush()
     # Initial Call
     printProgressBar(0)
-    # Update Progress Bar
+    # Update Progress Bar once per item, after the item is processed
     for i, item in enumerate(iterable):
         if (prefix == ''):
             _prefix = item
-        printProgressBar(i)
         yield item
         printProgressBar(i + 1)
     # Print New Line on Complete
     print()
 
 
+# Help text printed with -h, --help or /? and when no arguments are given.
+_HELP_TEXT = (
+    "___  ___ _   __                            \n"
+    "|  \\/  || | / /                            \n"
+    "| .  . || |/ /   ___ _ __  _ __ ___  _ __  \n"
+    "| |\\/| ||    \\  / __| '_ \\| '_ ` _ \\| '_ \\ \n"
+    "| |  | || |\\  \\ \\__ \\ | | | | | | | | |_) |\n"
+    "\\_|  |_/\\_| \\_/ |___/_| |_|_| |_| |_| .__/ \n"
+    "                                    | |    \n"
+    "                                    |_|    \n"
+    "\nDESCRIPTION: \n"
+    "Get MFP device information from device via SNMP.\n"
+    "Data returned from device:\n"
+    "model, serialnumber, location, firmware, hostname, domain, ip_address, subnet, gateway, primary_dns, secondary_dns\n"
+    "\nUSAGE: \n"
+    " -ip or --ip_address\n"
+    "  Get singe device information, data is returned to csv file.\n"
+    "\n -ipr or --ip_range\n"
+    "  Scan IP range for devices and return information to csv file.\n"
+    "\n -p or --probe\n"
+    "  OPTIONAL: How devices are found in IP range scan, icmp (ping) or tcp. Default value is icmp.\n"
+    "  tcp does not require administrator rights.\n"
+    "\n -c or --community\n"
+    "  OPTIONAL: Change SNMP community name for query. Default value is public.\n"
+    "\n -s or --set\n"
+    "  Write new value to OID in device.\n"
+    "\nEXAMPLE: \n"
+    " -ip 192.168.1.10\n"
+    " -ipr 192.168.1.1 192.168.1.255\n"
+    " -ipr 192.168.1.0/24\n"
+    " -ipr 192.168.1.0/24 --probe tcp\n"
+    " --community private --ip_address 192.168.1.10\n"
+    '-ip 192.168.1.10 --set .1.3.6.1.2.1.1.6.0 "new location"\n'
+)
+
+
 def help():
     """
     Prints help to terminal
 
     """
+    sys.stdout.write(_HELP_TEXT)
 
-    print("___  ___ _   __                            ")
-    print("|  \\/  || | / /                            ")
-    print("| .  . || |/ /   ___ _ __  _ __ ___  _ __  ")
-    print("| |\\/| ||    \\  / __| '_ \\| '_ ` _ \\| '_ \\ ")
-    print("| |  | || |\\  \\ \\__ \\ | | | | | | | | |_) |")
-    print("\\_|  |_/\\_| \\_/ |___/_| |_|_| |_| |_| .__/ ")
-    print("                                    | |    ")
-    print("                                    |_|    ")
-
-    print("\nDESCRIPTION: ")
-    print("Get MFP device information from device via SNMP.")
-    print("Data returned from device:")
-    print("model, serialnumber, location, firmware, hostname, domain, ip_address, subnet, gateway, primary_dns, secondary_dns")
 
-    print("\nUSAGE: ")
-    print(" -ip or --ip_address")
-    print("  Get singe device information, data is returned to csv file.")
-
-    print("\n -ipr or --ip_range")
-    print("  Scan IP range for devices and return information to csv file.")
-
-    print("\n -c or --community")
-    print("  OPTIONAL: Change SNMP community name for query. Default value is public.")
+def parse_arguments(arguments):
+    """
+    Parse command line arguments. Option names are case insensitive.
 
-    print("\n -s or --set")
-    print("  Write new value to OID in device.")
+    @params:
+        arguments       - Required  : command line arguments without program name (Str list)
 
-    print("\nEXAMPLE: ")
-    print(" -ip 192.168.1.10")
-    print(" -ipr 192.168.1.1 192.168.1.255")
-    print(" -ipr 192.168.1.0/24")
-    print(" --community private --ip_address 192.168.1.10")
-    print('-ip 192.168.1.10 --set .1.3.6.1.2.1.1.6.0 "new location"')
+    @return:
+        args            : Parsed arguments (Namespace)
+    """
+    parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    actions = [
+        parser.add_argument('-h', '--help', action='store_true'),
+        parser.add_argument('-c', '--community'),
+        parser.add_argument('-ip', '--ip_address'),
+        parser.add_argument('-ipr', '--ip_range', nargs='+'),
+        parser.add_argument('-s', '--set', nargs=2, metavar=('OID', 'VALUE')),
+        parser.add_argument('-f', '--find_serial'),
+        parser.add_argument('-p', '--probe', type=str.lower, choices=tuple(_PROBES), default='icmp'),
+    ]
+
+    options = {option for action in actions for option in action.option_strings}
+    # Only '/?' is a windows style option, other values starting with '/' are kept as values.
+    arguments = ['-h' if arg == '/?' else arg for arg in arguments]
+    return parser.parse_args([arg.lower() if arg.lower() in options else arg for arg in arguments])
 
 
 def main():
     # get command line arguments
-
-    execute = False
-    address = None
-    write = False
-    oid = None
-    value = None
-    start_ip = None
-    end_ip = None
-    serialnumber = None
+    args = parse_arguments(argv[1:])
+    address = args.ip_address
+    write = args.set is not None
+    ip_range = None
+    latencies = {}
+    serialnumber = args.find_serial
     community = hlapi.CommunityData('public')
 
-    for index, arg in enumerate(argv):
-        index += 1
-        if (arg.lower() == "-h" or arg == "/?" or arg.lower() == "--help"):
-            help()
-            raise SystemExit
-
-        if (arg.lower() == "-c" or arg.lower() == "--community"):
-            try:
-                print(f'community name changed: {argv[index]}')
-                community = hlapi.CommunityData(argv[index])
-            except IndexError:
-                print(
-                    '\nERROR: Incorrect use of community. No value given for one or more required parameters.\n')
-                print('EXAMPLE: \n-c public')
-                raise SystemExit
-
-        if (arg.lower() == "-ip" or arg.lower() == "--ip_address"):
-            try:
-                address = argv[index]
-            except IndexError:
-                print(
-                    '\nERROR: Incorrect use of ip address. No value given for one or more required parameters.\n')
-                print('EXAMPLE: \n-ip 192.168.1.10')
-                raise SystemExit
-            execute = True
-
-        if (arg.lower() == "-ipr" or arg.lower() == "--ip_range"):
-            try:
-                if (len(argv[index].rsplit('/')) > 1):
-                    start_ip = ipaddress.IPv4Network(
-                        argv[index]).network_address
-                    end_ip = ipaddress.IPv4Network(
-                        argv[index]).broadcast_address
-                else:
-                    start_ip = argv[index]
-                    end_ip = argv[index + 1]
-            except IndexError:
-                print(
-                    '\nERROR: Incorrect use of ip range. Use CIDR notation or give two ip addresses separeted by space.')
-                print('EXAMPLE: \n-ipr 192.168.1.1 192.168.1.10\n-ipr 192.168.1.0/24')
-                raise SystemExit
-            execute = True
-
-        if (arg.lower() == "-s" or arg.lower() == "--set"):
-            try:
-                oid = argv[index]
-                value = argv[index + 1]
-            except IndexError:
-                print(
-                    '\nERROR: Incorrect use of set. Give OID and value separeted by space.\n')
-                print(
-                    'EXAMPLE: \n-ip 192.168.1.10 --set .1.3.6.1.2.1.1.6.0 "new location"')
-                raise SystemExit
-            write = True
-            execute = True
+    if (args.help):
+        help()
+        raise SystemExit
 
-        if (arg.lower() == "-f" or arg.lower() == "--find_serial"):
-            try:
-                serialnumber = argv[index]
-            except IndexError:
-                print(
-                    '\nERROR: Incorrect use of find serial. No value given for one or more required parameters.')
-                print(
-                    'EXAMPLE: \n-f AA2K027512345 -ipr 192.168.1.1 192.168.1.10\n-f AA2K027512345 -ipr 192.168.1.0/24')
-                raise SystemExit
-            execute = True
+    if (args.community is not None):
+        print(f'community name changed: {args.community}')
+        community = hlapi.CommunityData(args.community)
+
+    if (args.ip_range is not None):
+        if (len(args.ip_range) == 1 and '/' in args.ip_range[0]):
+            network = ipaddress.IPv4Network(args.ip_range[0])
+            ip_range = (int(network.network_address), int(network.broadcast_address))
+            if (network.prefixlen < 31):
+                # Network and broadcast addresses are not hosts and are left out.
+                ip_range = (ip_range[0] + 1, ip_range[1] - 1)
+        elif (len(args.ip_range) == 2):
+            ip_range = tuple(int(ipaddress.IPv4Address(address)) for address in args.ip_range)
+        else:
+            print(
+                '\nERROR: Incorrect use of ip range. Use CIDR notation or give two ip addresses separeted by space.')
+            print('EXAMPLE: \n-ipr 192.168.1.1 192.168.1.10\n-ipr 192.168.1.0/24')
+            raise SystemExit
 
-    if (address is None and execute is False):
+    execute = address is not None or args.ip_range is not None or write or serialnumber is not None
+    if (not execute):
         help()
         raise SystemExit
 
-    if (write and oid is not None and value is not None):
+    if (write):
+        oid, value = args.set
         print(f'Connecting to address: {address}')
         dataset = {}
         dataset[oid] = value
@@ -444,52 +883,48 @@ def main():
             f.write('\n')
 
     if (execute and address is None):
-        if (serialnumber is not None and (start_ip is None or end_ip is None)):
+        if (serialnumber is not None and ip_range is None):
             print(
                 '\nERROR: IP address range not given. --find_serial also requires use of --ip_range or -ipr\n')
             print('EXAMPLE: \n-f AA2K027512345 -ipr 192.168.1.1 192.168.1.10\n-f AA2K027512345 -ipr 192.168.1.0/24')
             raise SystemExit
-        if (start_ip is not None and end_ip is not None):
+        if (ip_range is not None):
             if (serialnumber is not None):
-                active = ping_sweep(start_ip, end_ip, silent=True)
+                active = ping_sweep(*ip_range, silent=True, probe=args.probe)
             else:
-                active = ping_sweep(start_ip, end_ip)
+                active = ping_sweep(*ip_range, probe=args.probe, latencies=latencies)
 
-        result = dict()
-        if (len(active) > 0):
-            data = []
-            if (serialnumber is not None):
-                result = get_device_by_serial(serialnumber, active, community)
-            else:
-                data = get_device_info(active, community)
-        else:
+        if (len(active) == 0):
             raise SystemExit
-        if (len(data) > 0):
-            difference = len(active) - len(data)
-            if (difference != 0):
+        if (serialnumber is not None):
+            result = get_device_by_serial(serialnumber, active, community)
+            if (len(result) > 0):
                 print(
-                    f'Data received from {len(data)} device(s). Were not able to get any data from {difference} device(s).')
+                    f'\nFound device with serialnumber {serialnumber} from address {result["response_address"]}.\n')
             else:
-                print(f'Data received from {len(data)} device(s).')
-            to_csv(data)
-        elif (len(result) > 0):
-            print(
-                f'\nFound device with serialnumber {serialnumber} from address {result["response_address"]}.\n')
-        elif (len(result) == 0):
-            print(f'\nNo device found with serialnumber {serialnumber}.\n')
+                print(f'\nNo device found with serialnumber {serialnumber}.\n')
         else:
-            print(
-                f'Were not able to get any data from {len(active)} device(s).')
-            print(active)
+            # Rows are passed to csv as devices respond, not collected first.
+            count = to_csv(dict(data, latency_ms=latencies.get(data['response_address'], ''))
+                           for data in get_device_info(active, community))
+            if (count > 0):
+                difference = len(active) - count
+                if (difference != 0):
+                    print(
+                        f'Data received from {count} device(s). Were not able to get any data from {difference} device(s).')
+                else:
+                    print(f'Data received from {count} device(s).')
+            else:
+                print(
+                    f'Were not able to get any data from {len(active)} device(s).')
+                print(active)
 
 
 if (__name__ == "__main__"):
+    start_time = time.perf_counter()
     try:
-        start_time = datetime.now()
         main()
-        end_time = datetime.now()
-        print(f'Program copleted in: {end_time - start_time}')
+        print(f'Program copleted in: {timedelta(seconds=time.perf_counter() - start_time)}')
     except Exception as e:
-        end_time = datetime.now()
-        print(f'Scanning failed in: {end_time - start_time}')
+        print(f'Scanning failed in: {timedelta(seconds=time.perf_counter() - start_time)}')
         print(e)